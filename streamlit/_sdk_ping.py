@@ -1,3 +1,4 @@
+import importlib.util
 import os
 import sys
 import time
@@ -15,20 +16,40 @@ if load_dotenv:
     load_dotenv(REPO_ROOT / ".env")
     load_dotenv(REPO_ROOT / ".env.local")
 
+# PROVIDER_MODE=record|replay runs the pings through a cassette (see cassette.py)
+from cassette import get_cassette  # noqa: E402
 
-def ping_groq() -> tuple[bool, str]:
+
+def through_cassette(request: dict, fn):
+    cassette = get_cassette()
+    return fn() if cassette is None else cassette.call(request, fn)
+
+
+def replaying() -> bool:
+    cassette = get_cassette()
+    return cassette is not None and cassette.mode == "replay"
+
+
+def installed(module: str) -> bool:
+    # Probe without importing, so the SDK is imported only where it is used
     try:
-        from groq import Groq
-    except Exception as e:  # noqa: BLE001
-        return False, f"groq import failed: {e}"
+        return importlib.util.find_spec(module) is not None
+    except (ImportError, ValueError):
+        return False
 
-    key = os.getenv("GROQ_API_KEY")
-    if not key:
-        return False, "GROQ_API_KEY missing"
 
+def ping_groq() -> tuple[bool, str]:
     model = os.getenv("GROQ_DEFAULT_MODEL", "meta-llama/llama-4-scout-17b-16e-instruct")
-    try:
-        t0 = time.time()
+    key = os.getenv("GROQ_API_KEY")
+    if not replaying():
+        if not installed("groq"):
+            return False, "groq not installed"
+        if not key:
+            return False, "GROQ_API_KEY missing"
+
+    def call() -> str:
+        from groq import Groq
+
         client = Groq(api_key=key)
         res = client.chat.completions.create(
             model=model,
@@ -36,8 +57,13 @@ def ping_groq() -> tuple[bool, str]:
             temperature=0,
             max_tokens=8,
         )
+        return (res.choices[0].message.content or "").strip()
+
+    try:
+        t0 = time.time()
+        request = {"provider": "groq", "model": model, "system": None, "prompt": "Say 'pong'", "temperature": 0.0, "max_tokens": 8, "top_p": 1.0}
+        text = through_cassette(request, call)
         dt = (time.time() - t0) * 1000
-        text = (res.choices[0].message.content or "").strip()
         ok = bool(text)
         return ok, f"{model} {dt:.0f}ms -> {text[:80]!r}"
     except Exception as e:  # noqa: BLE001
@@ -45,18 +71,17 @@ def ping_groq() -> tuple[bool, str]:
 
 
 def ping_gemini() -> tuple[bool, str]:
-    try:
-        import google.generativeai as genai
-    except Exception as e:  # noqa: BLE001
-        return False, f"google-generativeai import failed: {e}"
-
+    model = os.getenv("GEMINI_DEFAULT_MODEL", "gemini-2.0-flash")
     key = os.getenv("GEMINI_API_KEY")
-    if not key:
-        return False, "GEMINI_API_KEY missing"
+    if not replaying():
+        if not installed("google.generativeai"):
+            return False, "google-generativeai not installed"
+        if not key:
+            return False, "GEMINI_API_KEY missing"
+
+    def call() -> str:
+        import google.generativeai as genai
 
-    model = os.getenv("GEMINI_DEFAULT_MODEL", "gemini-2.0-flash")
-    try:
-        t0 = time.time()
         genai.configure(api_key=key)
         mm = genai.GenerativeModel(model_name=model)
         res = mm.generate_content(
@@ -67,7 +92,6 @@ def ping_gemini() -> tuple[bool, str]:
                 "top_p": 1,
             },
         )
-        dt = (time.time() - t0) * 1000
         text = ""
         try:
             if getattr(res, "text", None):
@@ -85,7 +109,13 @@ def ping_gemini() -> tuple[bool, str]:
                                 text = getattr(parts[0], "text", "")
         except Exception:
             text = ""
-        text = (text or "").strip()
+        return (text or "").strip()
+
+    try:
+        t0 = time.time()
+        request = {"provider": "gemini", "model": model, "system": None, "prompt": "Return the word pong", "temperature": 0.0, "max_tokens": 8, "top_p": 1.0}
+        text = through_cassette(request, call)
+        dt = (time.time() - t0) * 1000
         ok = True  # treat as reachable even if empty text
         return ok, f"{model} {dt:.0f}ms -> {text[:80]!r}"
     except Exception as e:  # noqa: BLE001
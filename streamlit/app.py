@@ -1,3 +1,6 @@
+import time
+from typing import Any, Dict, List
+
 import streamlit as st
 
 from utils import (
@@ -5,16 +8,39 @@ from utils import (
     load_flows,
     save_flows,
     get_default_model,
+    run_nodes,
+    prepare_prompt,
     format_prompt,
-    generate,
+    current_user,
+    login_user,
+    generate_candidates,
+    default_timeout,
 )
+from candidates import MAX_CANDIDATES, SCORERS, scorer_for, target_words
+from budget import COMPACTION_STRATEGIES
+from scheduler import get_scheduler
+from similarity import get_index, reuse_enabled, scope_for
+from cassette import get_cassette
+from flow_client import cancel_run, run_status, service_metrics, service_url, stream_run, submit_run
 
 
 st.set_page_config(page_title="Flow Builder", layout="wide")
 load_env()
 
+# Scheduler identity: a Streamlit login wins; otherwise the name entered here
+if login_user():
+    st.sidebar.caption(f"Signed in as {login_user()}")
+else:
+    st.sidebar.text_input("User", key="user_name", help="Your name for fair scheduling; matches SCHED_USER_WEIGHTS.")
+
 st.title("Flow Builder")
 st.caption("Home shows presets. Click a card to open the editor. In the editor, click Run Flow to execute all nodes and see output on the right.")
+_cas = get_cassette()
+if _cas is not None:
+    st.info(
+        f"Provider mode: {_cas.mode} ({_cas.path}); similar-prompt reuse is off. "
+        "Set PROVIDER_MODE=live to call providers directly."
+    )
 
 
 # Load flows and pick active
@@ -81,6 +107,10 @@ if "screen" not in st.session_state:
 screen = st.session_state["screen"]
 
 
+# Node cards per page in the editor grid
+NODES_PER_PAGE = 12
+
+
 # Outputs storage
 if "node_outputs" not in st.session_state:
     st.session_state["node_outputs"] = {}
@@ -90,14 +120,41 @@ def step_key(idx: int) -> str:
     return steps[idx].get("output_key", f"step{idx+1}")
 
 
+def mark_dirty(idx: int | None = None) -> None:
+    # None means the node list itself changed (add/move/delete): rebuild all
+    if idx is None:
+        st.session_state["node_cache"] = []
+    else:
+        st.session_state.setdefault("node_dirty", set()).add(idx)
+
+
 def move_item(idx: int, direction: int) -> None:
     j = idx + direction
     if 0 <= j < len(steps):
         steps[idx], steps[j] = steps[j], steps[idx]
+        mark_dirty()
 
 
 def delete_item(idx: int) -> None:
+    key = step_key(idx)
     del steps[idx]
+    # Forget the removed node's results so the Output panel can't show them
+    if not any(step_key(i) == key for i in range(len(steps))):
+        st.session_state.get("node_outputs", {}).pop(key, None)
+        st.session_state.get("node_candidates", {}).pop(key, None)
+    mark_dirty()
+
+
+def last_key() -> str | None:
+    return step_key(len(steps) - 1) if steps else None
+
+
+def rerun_after_change(before: str | None, removed: bool = False) -> None:
+    # The Output panel shows the last node's output: if that node changed, or
+    # results were dropped, rerun the whole app instead of just the grid
+    if removed or last_key() != before:
+        st.rerun()
+    st.rerun(scope="fragment")
 
 
 def add_item() -> None:
@@ -112,17 +169,16 @@ def add_item() -> None:
             "temperature": 0.7,
             "max_tokens": 1200,
             "top_p": 1.0,
+            "timeout": 0.0,
         }
     )
-
-
-def open_editor(idx: int) -> None:
-    st.session_state["edit_idx"] = idx
+    mark_dirty()
 
 
 @st.dialog("Edit Node")
 def edit_node(idx: int):
     s = steps[idx]
+    mark_dirty(idx)
     st.markdown(f"Editing node #{idx+1}")
     cols = st.columns([3, 2])
     with cols[0]:
@@ -141,23 +197,126 @@ def edit_node(idx: int):
         s["max_tokens"] = int(
             st.number_input("Max tokens", min_value=1, max_value=4000, value=int(s.get("max_tokens", 1200)), step=50, key=f"maxtok_{idx}")
         )
+        s["timeout"] = float(
+            st.number_input(
+                "Timeout (s, 0 = default)",
+                min_value=0.0,
+                max_value=3600.0,
+                value=min(3600.0, float(s.get("timeout") or 0)),
+                step=5.0,
+                key=f"timeout_{idx}",
+                help=f"0 uses NODE_TIMEOUT_S (now {default_timeout():g}s).",
+            )
+        )
+        s["similar_threshold"] = float(
+            st.number_input(
+                "Reuse similar prompts (0 = off)",
+                min_value=0.0,
+                max_value=1.0,
+                value=float(s.get("similar_threshold", 0.0)),
+                step=0.05,
+                key=f"simthr_{idx}",
+                help="Reuse a past output for this node/model when the rendered prompt is at least this similar.",
+            )
+        )
+        s["similar_mode"] = st.selectbox(
+            "On similar match",
+            ["reuse", "draft"],
+            index=1 if s.get("similar_mode") == "draft" else 0,
+            key=f"simmode_{idx}",
+            help="reuse: return the past output. draft: show it while a fresh call runs.",
+        )
+        s["input_budget"] = int(
+            st.number_input(
+                "Input budget (tokens, 0 = context window)",
+                min_value=0,
+                max_value=1000000,
+                value=int(s.get("input_budget", 0)),
+                step=500,
+                key=f"inbudget_{idx}",
+            )
+        )
+        s["compaction"] = st.selectbox(
+            "Compaction",
+            COMPACTION_STRATEGIES,
+            index=COMPACTION_STRATEGIES.index(s.get("compaction", "truncate")) if s.get("compaction") in COMPACTION_STRATEGIES else 0,
+            key=f"compact_{idx}",
+            help="How oversized upstream outputs are shrunk to fit the input budget.",
+        )
+        s["candidates"] = int(
+            st.number_input("Candidates", min_value=1, max_value=MAX_CANDIDATES, value=int(s.get("candidates", 1)), step=1, key=f"cands_{idx}")
+        )
+        if s["candidates"] > 1:
+            models_in = st.text_input(
+                "Candidate models (comma-separated, optional)",
+                value=", ".join(s.get("candidate_models", [])),
+                key=f"cmodels_{idx}",
+            )
+            s["candidate_models"] = [m.strip() for m in models_in.split(",") if m.strip()]
+            temps_in = st.text_input(
+                "Candidate temperatures (comma-separated, optional)",
+                value=", ".join(str(t) for t in s.get("candidate_temperatures", [])),
+                key=f"ctemps_{idx}",
+            )
+            s["candidate_temperatures"] = [float(t) for t in temps_in.split(",") if t.strip().replace(".", "", 1).isdigit()]
+            s["scorer"] = st.selectbox(
+                "Scorer",
+                list(SCORERS),
+                index=list(SCORERS).index(s.get("scorer", "keywords")) if s.get("scorer") in SCORERS else 0,
+                key=f"scorer_{idx}",
+            )
+            if s["scorer"] == "keywords":
+                s["keywords"] = st.text_input("Keywords (comma-separated)", value=s.get("keywords", ""), key=f"kw_{idx}")
+            if scorer_for(s) == "length":
+                s["target_words"] = int(
+                    st.number_input(
+                        "Target words (0 = from max tokens)",
+                        min_value=0,
+                        max_value=20000,
+                        value=int(s.get("target_words", 0)),
+                        step=50,
+                        key=f"tw_{idx}",
+                    )
+                )
+            if scorer_for(s) != s["scorer"]:
+                st.warning(f"No keywords set: candidates are scored by length instead (about {target_words(s)} words).")
     st.divider()
     # Optional quick test-run in dialog
     st.markdown("#### Test run (optional)")
-    if st.button("Run Test", key=f"run_test_{idx}"):
+    run_test = st.button("Run Test", key=f"run_test_{idx}")
+    if run_test and service_url():
+        test_remote(idx)
+    elif run_test:
         try:
             variables = dict(st.session_state.get("node_outputs", {}))
-            prompt_text = format_prompt(s.get("template", ""), variables)
-            out = generate(
-                s.get("provider", "Groq"),
-                prompt_text,
-                None,
-                s.get("model", get_default_model(s.get("provider", "Groq"))),
-                float(s.get("temperature", 0.7)),
-                int(s.get("max_tokens", 1200)),
-                float(s.get("top_p", 1.0)),
-            )
-            st.text_area("Output", value=out, height=200)
+            timeout = float(s.get("timeout") or default_timeout())
+            t_end = time.monotonic() + timeout
+            raw_prompt = format_prompt(s.get("template", ""), variables)
+            threshold = float(s.get("similar_threshold", 0.0)) if reuse_enabled() else 0.0
+            hit = get_index().lookup(scope_for(s), raw_prompt, threshold) if threshold > 0 else None
+            if hit is not None and s.get("similar_mode") != "draft":
+                st.caption(f"Reused a similar past output (similarity {hit[1]:.2f}).")
+                st.text_area("Output", value=hit[0], height=200)
+            else:
+                draft_box = st.empty()
+                if hit is not None:
+                    draft_box.text_area(f"Draft (similarity {hit[1]:.2f}, fresh call running)", value=hit[0], height=200)
+                user = current_user()
+                # Compact only on a reuse miss; generation gets what compaction left
+                prompt_text, max_tokens = prepare_prompt(s, variables, timeout=timeout, user=user, priority="test")
+                out, cands = generate_candidates(
+                    s,
+                    prompt_text,
+                    max_tokens,
+                    timeout=max(0.001, t_end - time.monotonic()),
+                    user=user,
+                    priority="test",
+                )
+                if threshold > 0:
+                    get_index().add(scope_for(s), raw_prompt, out)
+                draft_box.text_area("Output", value=out, height=200)
+                if len(cands) > 1:
+                    show_candidates(cands)
         except Exception as e:  # noqa: BLE001
             st.error(str(e))
     st.divider()
@@ -165,122 +324,297 @@ def edit_node(idx: int):
         st.rerun()
 
 
+def test_remote(idx: int) -> None:
+    # Run Test on the flow service: a single-node run at test priority
+    spec = {
+        "nodes": [node_from_step(steps[idx], idx)],
+        "edges": [],
+        "variables": dict(st.session_state.get("node_outputs", {})),
+        "priority": "test",
+        "user": current_user(),
+    }
+    box = st.empty()
+    try:
+        for ev in stream_run(submit_run(spec)):
+            if ev.get("type") == "draft":
+                box.text_area(f"Draft (similarity {float(ev.get('score') or 0):.2f}, fresh call running)", value=ev.get("text", ""), height=200)
+            elif ev.get("type") == "status" and ev.get("status") in ("done", "cancelled", "failed"):
+                res = remote_result(ev)
+                key = step_key(idx)
+                for k, err in res["errors"].items():
+                    st.error(f"{k}: {err}")
+                if key in res["reused"]:
+                    st.caption(f"Reused a similar past output (similarity {res['reused'][key]:.2f}).")
+                if key in res["outputs"]:
+                    box.text_area("Output", value=res["outputs"][key], height=200)
+                else:
+                    box.empty()
+                if res.get("candidates", {}).get(key):
+                    show_candidates(res["candidates"][key])
+    except Exception as e:  # noqa: BLE001
+        box.empty()
+        st.error(str(e))
+
+
+def show_candidates(cands: List[Dict[str, Any]], label: str = "") -> None:
+    with st.expander(f"Candidates{f' for `{label}`' if label else ''} ({len(cands)})", expanded=False):
+        for j, c in enumerate(cands):
+            mark = " (winner)" if c.get("winner") else ""
+            scorer = f" ({c['scorer']})" if c.get("scorer") else ""
+            st.markdown(f"**#{j+1}{mark}** `{c.get('model')}` · temp {c.get('temperature')} · score {c.get('score', 0.0):.2f}{scorer}")
+            if c.get("score_error"):
+                st.caption(f"Scoring failed: {c['score_error']}")
+            if c.get("error"):
+                st.error(c["error"])
+            else:
+                st.code(c.get("text", ""), language="markdown")
+
+
+def node_from_step(s: Dict[str, Any], i: int) -> Dict[str, Any]:
+    return {
+        "id": i + 1,
+        "label": s.get("label", f"Step {i+1}"),
+        "output_key": s.get("output_key", f"step{i+1}"),
+        "template": s.get("template", ""),
+        "provider": s.get("provider", "Groq"),
+        "model": s.get("model", get_default_model(s.get("provider", "Groq"))),
+        "temperature": float(s.get("temperature", 0.7)),
+        "max_tokens": int(s.get("max_tokens", 1200)),
+        "top_p": float(s.get("top_p", 1.0)),
+        "timeout": float(s.get("timeout") or 0),
+        "similar_threshold": float(s.get("similar_threshold", 0.0)),
+        "similar_mode": s.get("similar_mode", "reuse"),
+        "input_budget": int(s.get("input_budget", 0)),
+        "compaction": s.get("compaction", "truncate"),
+        "candidates": int(s.get("candidates", 1)),
+        "candidate_models": list(s.get("candidate_models", [])),
+        "candidate_temperatures": list(s.get("candidate_temperatures", [])),
+        "scorer": s.get("scorer", "keywords"),
+        "keywords": s.get("keywords", ""),
+        "target_words": int(s.get("target_words", 0)),
+    }
+
+
+def build_nodes() -> List[Dict[str, Any]]:
+    # Only nodes marked dirty since the last build are re-serialized
+    cache = st.session_state.setdefault("node_cache", [])
+    dirty = st.session_state.setdefault("node_dirty", set())
+    if len(cache) != len(steps):
+        cache[:] = [None] * len(steps)
+    for i, s in enumerate(steps):
+        if cache[i] is None or i in dirty:
+            cache[i] = node_from_step(s, i)
+    dirty.clear()
+    return list(cache)
+
+
+def render_toolbar() -> None:
+    toolbar = st.columns([1, 1, 3])
+    with toolbar[0]:
+        if st.button("Add Node"):
+            add_item()
+            # Jump to the page holding the new node
+            st.session_state["node_page"] = (len(steps) - 1) // NODES_PER_PAGE
+            st.rerun()
+    with toolbar[1]:
+        if st.button("Save Flow"):
+            # Build nodes and auto-connect linearly
+            nodes = build_nodes()
+            edges = []
+            for i in range(1, len(nodes)):
+                edges.append({"source": i, "target": i + 1})
+            current["graph"] = {"nodes": nodes, "edges": edges}
+            save_flows(data)
+            st.success("Flow saved.")
+
+
+def node_card(i: int) -> None:
+    s = steps[i]
+    with st.container(border=True):
+        lbl = s.get("label", f"Step {i+1}")
+        keyv = s.get("output_key", f"step{i+1}")
+        st.markdown(f"**{i+1}. {lbl}**\n\n`{keyv}`")
+        bcols = st.columns([1, 1, 1])
+        with bcols[0]:
+            if st.button("Edit", key=f"edit_{i}"):
+                edit_node(i)
+        with bcols[1]:
+            if st.button("Up", key=f"up_{i}"):
+                before = last_key()
+                move_item(i, -1)
+                rerun_after_change(before)
+        with bcols[2]:
+            if st.button("Down", key=f"down_{i}"):
+                before = last_key()
+                move_item(i, +1)
+                rerun_after_change(before)
+        if st.button("Delete", key=f"del_{i}"):
+            delete_item(i)
+            rerun_after_change(None, removed=True)
+
+
+@st.fragment
+def node_grid() -> None:
+    # Reruns on its own: card clicks redraw one page of cards, not the whole app
+    st.subheader("Nodes")
+    if not steps:
+        st.info("No nodes yet. Click 'Add Node'.")
+        return
+    pages = max(1, (len(steps) + NODES_PER_PAGE - 1) // NODES_PER_PAGE)
+    page = min(int(st.session_state.get("node_page", 0)), pages - 1)
+    if pages > 1:
+        nav = st.columns([1, 2, 1])
+        with nav[0]:
+            if st.button("Prev", disabled=page == 0, key="page_prev"):
+                st.session_state["node_page"] = page - 1
+                st.rerun(scope="fragment")
+        with nav[1]:
+            st.caption(f"Page {page + 1} of {pages} · {len(steps)} nodes")
+        with nav[2]:
+            if st.button("Next", disabled=page >= pages - 1, key="page_next"):
+                st.session_state["node_page"] = page + 1
+                st.rerun(scope="fragment")
+    cols = st.columns(4)
+    start = page * NODES_PER_PAGE
+    for i in range(start, min(start + NODES_PER_PAGE, len(steps))):
+        with cols[i % 4]:
+            node_card(i)
+
+
+# Seconds between status polls while a remote run is in flight
+REMOTE_POLL_S = 1.0
+
+
+def remote_result(ev: Dict[str, Any]) -> Dict[str, Any]:
+    # A finished service run (status snapshot or final stream event) as a run_nodes result
+    res: Dict[str, Any] = {"outputs": {}, "errors": {}, "skipped": [], "reused": {}}
+    res.update({k: ev[k] for k in ("outputs", "errors", "skipped", "reused", "candidates") if k in ev})
+    if ev.get("error"):
+        res["errors"] = {**res["errors"], "flow": ev["error"]}
+    return res
+
+
+def poll_remote_run() -> Dict[str, Any] | None:
+    # One poll of the run in session_state["remote_run"]. Returns its result once it
+    # has finished; otherwise draws progress and a Cancel button and returns None.
+    run_id = st.session_state["remote_run"]
+    try:
+        snap = run_status(run_id)
+    except Exception as e:  # noqa: BLE001
+        st.session_state["remote_run"] = None
+        return {"outputs": {}, "errors": {"flow": str(e)}, "skipped": [], "reused": {}}
+    if snap.get("status") in ("done", "cancelled", "failed"):
+        st.session_state["remote_run"] = None
+        return remote_result(snap)
+    done = snap.get("done") or {}
+    st.info(f"Run `{run_id}` {snap.get('status')}: {len(done)} of {len(snap.get('nodes') or [])} nodes finished.")
+    for key, status in done.items():
+        st.caption(f"`{key}`: {status}")
+    draft = snap.get("draft")
+    if draft:
+        st.info(f"Draft for `{draft.get('key')}` (similarity {float(draft.get('score') or 0):.2f}) while the fresh call runs:\n\n{draft.get('text')}")
+    cancelling = st.session_state.get("remote_cancel") == run_id
+    if st.button("Cancel run", disabled=cancelling):
+        try:
+            cancel_run(run_id)
+            st.session_state["remote_cancel"] = run_id
+        except Exception as e:  # noqa: BLE001
+            st.error(str(e))
+    if st.session_state.get("remote_cancel") == run_id:
+        st.caption("Cancelling: the service stops before the next node; outputs so far are kept.")
+    return None
+
+
+@st.fragment
+def output_panel() -> None:
+    # Run Flow lives with its output so a run only reruns this panel
+    st.subheader("Output")
+    rcols = st.columns([1, 2])
+    with rcols[1]:
+        current["deadline"] = float(
+            st.number_input(
+                "Flow deadline (s, 0 = none)",
+                min_value=0.0,
+                max_value=3600.0,
+                value=float(current.get("deadline", 0.0)),
+                step=10.0,
+                key="flow_deadline",
+            )
+        )
+    with rcols[0]:
+        run = st.button("Run Flow", type="primary", disabled=bool(st.session_state.get("remote_run")))
+    res: Dict[str, Any] | None = None
+    if run and service_url():
+        # Submit and return; the panel polls the service on each rerun below
+        try:
+            st.session_state["remote_run"] = submit_run(
+                {"nodes": build_nodes(), "deadline": float(current.get("deadline", 0)), "user": current_user(), "priority": "flow"}
+            )
+        except Exception as e:  # noqa: BLE001
+            res = {"outputs": {}, "errors": {"flow": str(e)}, "skipped": [], "reused": {}}
+    elif run:
+        nodes = build_nodes()
+        # Linear run within the flow deadline (0 = none)
+        draft_box = st.empty()
+
+        def show_draft(key: str, text: str, score: float) -> None:
+            draft_box.info(f"Draft for `{key}` (similarity {score:.2f}) while the fresh call runs:\n\n{text}")
+
+        deadline = float(current.get("deadline", 0))
+        try:
+            res = run_nodes(nodes, deadline_s=deadline or None, on_draft=show_draft)
+        except Exception as e:  # noqa: BLE001
+            res = {"outputs": {}, "errors": {"flow": str(e)}, "skipped": [], "reused": {}}
+        draft_box.empty()
+    if st.session_state.get("remote_run"):
+        res = poll_remote_run()
+    if res is not None:
+        st.session_state["node_outputs"] = res["outputs"]
+        for key, err in res["errors"].items():
+            st.error(f"{key}: {err}")
+        if res["skipped"]:
+            st.warning("Skipped (deadline, cancel or failed upstream): " + ", ".join(res["skipped"]))
+        for key, score in res["reused"].items():
+            st.caption(f"`{key}` reused a similar past output (similarity {score:.2f}).")
+        st.session_state["node_candidates"] = res.get("candidates", {})
+    outs = st.session_state.get("node_outputs", {})
+    # Prefer the last node's output; it may not have run yet
+    shown = last_key() or next(iter(outs), None)
+    if shown in outs:
+        st.code(outs[shown], language="markdown")
+        for key, cands in st.session_state.get("node_candidates", {}).items():
+            show_candidates(cands, key)
+    elif outs:
+        st.caption(f"No output for `{shown}` yet; run the flow to refresh.")
+    else:
+        st.caption("Run the flow to see output here.")
+    if service_url():
+        with st.expander("Flow service", expanded=False):
+            try:
+                st.json(service_metrics())
+            except Exception as e:  # noqa: BLE001
+                st.error(str(e))
+        if st.session_state.get("remote_run"):
+            # Poll again by rerunning just this panel
+            time.sleep(REMOTE_POLL_S)
+            st.rerun(scope="fragment")
+        return
+    with st.expander("Scheduler", expanded=False):
+        st.json(get_scheduler().metrics())
+    with st.expander("Similar-prompt reuse", expanded=False):
+        st.json(get_index().metrics())
+
+
 def render_editor():
     # Two-column layout: left editor, right outputs
     left, right = st.columns([7, 5])
 
     with left:
-        toolbar = st.columns([1, 1, 1, 2])
-        with toolbar[0]:
-            if st.button("Add Node"):
-                add_item()
-                st.rerun()
-        with toolbar[1]:
-            if st.button("Save Flow"):
-                # Build nodes and auto-connect linearly
-                nodes = []
-                for i, s in enumerate(steps):
-                    nodes.append(
-                        {
-                            "id": i + 1,
-                            "label": s.get("label", f"Step {i+1}"),
-                            "output_key": s.get("output_key", f"step{i+1}"),
-                            "template": s.get("template", ""),
-                            "provider": s.get("provider", "Groq"),
-                            "model": s.get("model", get_default_model(s.get("provider", "Groq"))),
-                            "temperature": float(s.get("temperature", 0.7)),
-                            "max_tokens": int(s.get("max_tokens", 1200)),
-                            "top_p": float(s.get("top_p", 1.0)),
-                        }
-                    )
-                edges = []
-                for i in range(1, len(nodes)):
-                    edges.append({"source": i, "target": i + 1})
-                current["graph"] = {"nodes": nodes, "edges": edges}
-                save_flows(data)
-                st.success("Flow saved.")
-        with toolbar[2]:
-            if st.button("Run Flow", type="primary"):
-                # Ensure we have latest nodes
-                nodes = []
-                for i, s in enumerate(steps):
-                    nodes.append(
-                        {
-                            "id": i + 1,
-                            "label": s.get("label", f"Step {i+1}"),
-                            "output_key": s.get("output_key", f"step{i+1}"),
-                            "template": s.get("template", ""),
-                            "provider": s.get("provider", "Groq"),
-                            "model": s.get("model", get_default_model(s.get("provider", "Groq"))),
-                            "temperature": float(s.get("temperature", 0.7)),
-                            "max_tokens": int(s.get("max_tokens", 1200)),
-                            "top_p": float(s.get("top_p", 1.0)),
-                        }
-                    )
-                # Linear run
-                st.session_state["node_outputs"] = {}
-                for nd in nodes:
-                    variables = dict(st.session_state.get("node_outputs", {}))
-                    prompt_text = format_prompt(nd.get("template", ""), variables)
-                    try:
-                        out = generate(
-                            nd.get("provider", "Groq"),
-                            prompt_text,
-                            None,
-                            nd.get("model", get_default_model(nd.get("provider", "Groq"))),
-                            float(nd.get("temperature", 0.7)),
-                            int(nd.get("max_tokens", 1200)),
-                            float(nd.get("top_p", 1.0)),
-                        )
-                        st.session_state["node_outputs"][nd.get("output_key", f"step{nd.get('id','')}")] = out
-                    except Exception as e:  # noqa: BLE001
-                        st.error(str(e))
-
-        st.subheader("Nodes")
-        if steps:
-            cols = st.columns(4)
-            for i, s in enumerate(steps):
-                c = cols[i % 4]
-                with c:
-                    with st.container(border=True):
-                        lbl = s.get("label", f"Step {i+1}")
-                        keyv = s.get("output_key", f"step{i+1}")
-                        st.markdown(f"**{i+1}. {lbl}**\n\n`{keyv}`")
-                        bcols = st.columns([1, 1, 1])
-                        with bcols[0]:
-                            if st.button("Edit", key=f"edit_{i}"):
-                                open_editor(i)
-                        with bcols[1]:
-                            if st.button("Up", key=f"up_{i}"):
-                                move_item(i, -1)
-                                st.rerun()
-                        with bcols[2]:
-                            if st.button("Down", key=f"down_{i}"):
-                                move_item(i, +1)
-                                st.rerun()
-                        if st.button("Delete", key=f"del_{i}"):
-                            delete_item(i)
-                            st.rerun()
-        else:
-            st.info("No nodes yet. Click 'Add Node'.")
+        render_toolbar()
+        node_grid()
 
     with right:
-        st.subheader("Output")
-        outs = st.session_state.get("node_outputs", {})
-        # Show latest output if any; else empty
-        if outs:
-            # Prefer last node's key
-            key_order = [s.get("output_key", f"step{i+1}") for i, s in enumerate(steps)]
-            last_key = key_order[-1] if key_order else next(iter(outs))
-            st.code(outs.get(last_key, ""), language="markdown")
-        else:
-            st.caption("Run the flow to see output here.")
-
-
-# Trigger editor dialog
-if "edit_idx" in st.session_state and st.session_state["edit_idx"] is not None:
-    edit_node(int(st.session_state["edit_idx"]))
-    st.session_state["edit_idx"] = None
+        output_panel()
 
 
 # Home vs Editor views
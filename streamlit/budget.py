@@ -0,0 +1,128 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Tuple
+
+# Rough characters per token by provider; no tokenizer dependency, errs high on
+# token counts so budgets stay safe.
+CHARS_PER_TOKEN = {"groq": 3.5, "gemini": 4.0}
+
+# Context windows (tokens) by model-name prefix; first match wins
+CONTEXT_WINDOWS = [
+    ("meta-llama/llama-4", 131072),
+    ("llama-3.1", 131072),
+    ("llama-3.3", 131072),
+    ("llama3", 8192),
+    ("gemma", 8192),
+    ("gemini-1.5", 1048576),
+    ("gemini-2", 1048576),
+]
+
+
+def default_context_window() -> int:
+    # Read on use so DEFAULT_CONTEXT_WINDOW from .env/.env.local applies
+    try:
+        return int(os.getenv("DEFAULT_CONTEXT_WINDOW", "8192"))
+    except ValueError:
+        return 8192
+
+
+COMPACTION_STRATEGIES = ["truncate", "headings", "summarize"]
+
+_CACHE: "OrderedDict[Tuple[str, str, int], str]" = OrderedDict()
+_CACHE_MAX = 256
+_CACHE_LOCK = threading.Lock()
+
+
+def estimate_tokens(text: str, provider: str = "groq") -> int:
+    text = text or ""
+    by_chars = len(text) / CHARS_PER_TOKEN.get(provider.lower(), 3.5)
+    by_words = len(re.findall(r"\S+", text)) * 1.3
+    return int(max(by_chars, by_words)) + 1
+
+
+def context_window(model: str) -> int:
+    m = (model or "").lower()
+    for prefix, size in CONTEXT_WINDOWS:
+        if m.startswith(prefix):
+            return size
+    return default_context_window()
+
+
+def truncate(text: str, max_tokens: int, provider: str = "groq") -> str:
+    if estimate_tokens(text, provider) <= max_tokens:
+        return text
+    limit = max(0, int(max_tokens * CHARS_PER_TOKEN.get(provider.lower(), 3.5) * 0.9))
+    cut = text[:limit]
+    # Prefer ending on a line boundary
+    if "\n" in cut[limit // 2 :]:
+        cut = cut[: cut.rfind("\n")]
+    return cut.rstrip() + "\n…"
+
+
+def headings_only(text: str, max_tokens: int, provider: str = "groq") -> str:
+    lines = [ln for ln in (text or "").splitlines() if re.match(r"\s*#{1,6}\s", ln)]
+    if not lines:
+        # No Markdown headings: keep top-level bullets instead
+        lines = [ln for ln in (text or "").splitlines() if re.match(r"[-*+]\s|\d+[.)]\s", ln)]
+    return truncate("\n".join(lines) if lines else text, max_tokens, provider)
+
+
+def compact(
+    text: str,
+    max_tokens: int,
+    strategy: str = "truncate",
+    provider: str = "groq",
+    summarize: Callable[[str, int], str] | None = None,
+) -> str:
+    # Shrink text to roughly max_tokens; results are cached by content/strategy/target
+    if estimate_tokens(text, provider) <= max_tokens:
+        return text
+    key = (hashlib.sha1((text or "").encode("utf-8")).hexdigest(), strategy, int(max_tokens))
+    with _CACHE_LOCK:
+        if key in _CACHE:
+            _CACHE.move_to_end(key)
+            return _CACHE[key]
+    if strategy == "summarize" and summarize is not None:
+        try:
+            out = truncate(summarize(text, max_tokens), max_tokens, provider)
+        except Exception:
+            # Not cached, so a later run with more time can still summarize
+            return truncate(text, max_tokens, provider)
+    elif strategy == "headings":
+        out = headings_only(text, max_tokens, provider)
+    else:
+        out = truncate(text, max_tokens, provider)
+    with _CACHE_LOCK:
+        _CACHE[key] = out
+        while len(_CACHE) > _CACHE_MAX:
+            _CACHE.popitem(last=False)
+    return out
+
+
+def fit_variables(
+    template_tokens: int,
+    variables: Dict[str, str],
+    budget: int,
+    strategy: str = "truncate",
+    provider: str = "groq",
+    summarize: Callable[[str, int], str] | None = None,
+) -> Dict[str, str]:
+    # Max-min fair split of what the template leaves: small variables pass through
+    # untouched and their slack goes to the larger ones, which get compacted.
+    sizes = {k: estimate_tokens(v, provider) for k, v in variables.items() if isinstance(v, str) and v}
+    room = max(0, budget - template_tokens)
+    if sum(sizes.values()) <= room:
+        return dict(variables)
+    out = dict(variables)
+    left = len(sizes)
+    for k, n in sorted(sizes.items(), key=lambda kv: kv[1]):
+        share = max(16, room // left)
+        if n > share:
+            out[k] = compact(variables[k], share, strategy, provider, summarize)
+            n = share
+        room = max(0, room - n)
+        left -= 1
+    return out
@@ -0,0 +1,152 @@
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+log = logging.getLogger(__name__)
+
+# Best-of-N selection for multi-candidate nodes. A scorer maps (text, node, ctx)
+# to a score where higher is better; register_scorer() adds new ones by name.
+# ctx carries the run's "user", "priority", "until" (time.monotonic() deadline),
+# "admission" (scheduler slots for scoring calls), the rendered "prompt" and the
+# node's effective "max_tokens".
+
+MAX_CANDIDATES = 8
+# Rough words per token, for a default length target
+WORDS_PER_TOKEN = 0.75
+
+Scorer = Callable[[str, Dict[str, Any], Dict[str, Any]], float]
+SCORERS: Dict[str, Scorer] = {}
+
+
+def register_scorer(name: str, fn: Scorer) -> None:
+    SCORERS[name] = fn
+
+
+def _keywords(node: Dict[str, Any]) -> List[str]:
+    # Same comma-separated form as the RUNLOG `keywords` column
+    return [k.strip().lower() for k in str(node.get("keywords", "")).split(",") if k.strip()]
+
+
+def keyword_coverage(text: str, node: Dict[str, Any], ctx: Dict[str, Any]) -> float:
+    kws = _keywords(node)
+    if not kws:
+        return 0.0
+    low = (text or "").lower()
+    return sum(1 for k in kws if k in low) / len(kws)
+
+
+def target_words(node: Dict[str, Any], ctx: Dict[str, Any] | None = None) -> int:
+    # Explicit target_words, else roughly what max_tokens allows
+    explicit = int(node.get("target_words") or 0)
+    if explicit > 0:
+        return explicit
+    return int(int((ctx or {}).get("max_tokens") or node.get("max_tokens") or 0) * WORDS_PER_TOKEN)
+
+
+def length_target(text: str, node: Dict[str, Any], ctx: Dict[str, Any]) -> float:
+    target = target_words(node, ctx)
+    words = len(re.findall(r"\S+", text or ""))
+    if target <= 0:
+        return 0.0
+    return max(0.0, 1.0 - abs(words - target) / target)
+
+
+def judge_provider() -> str:
+    return os.getenv("JUDGE_PROVIDER", "Groq")
+
+
+def llm_judge(text: str, node: Dict[str, Any], ctx: Dict[str, Any]) -> float:
+    # Cheap-model rating 0-10; imported lazily to avoid a cycle with utils
+    from utils import default_timeout, generate
+
+    provider = judge_provider()
+    until = ctx.get("until")
+    timeout = float(node.get("timeout") or default_timeout())
+    if until is not None:
+        timeout = min(timeout, until - time.monotonic())
+        if timeout <= 0:
+            raise TimeoutError("no time left to judge")
+    # Judge inside the group's admission when it is on the judge's provider
+    adm = ctx.get("admission")
+    if adm is not None and adm.provider != provider.lower():
+        adm = None
+    # The rendered prompt, not the template with its {placeholders}
+    task = ctx.get("prompt") or node.get("template", "")
+    prompt = (
+        "Rate the following draft from 0 to 10 for how well it fulfils the task. "
+        "Reply with the number only.\n\n"
+        f"Task:\n{task}\n\nDraft:\n{text}"
+    )
+    reply = generate(
+        provider,
+        prompt,
+        None,
+        os.getenv("JUDGE_MODEL", "llama-3.1-8b-instant"),
+        0.0,
+        8,
+        1.0,
+        timeout=timeout,
+        user=ctx.get("user"),
+        priority=str(ctx.get("priority", "flow")),
+        admission=adm,
+        until=until if adm is not None else None,
+    )
+    m = re.search(r"\d+(\.\d+)?", reply or "")
+    return min(10.0, float(m.group())) / 10 if m else 0.0
+
+
+register_scorer("keywords", keyword_coverage)
+register_scorer("length", length_target)
+register_scorer("judge", llm_judge)
+
+
+def candidate_settings(node: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # Candidate i cycles through candidate_models / candidate_temperatures;
+    # the first one always uses the node's own settings.
+    n = max(1, min(MAX_CANDIDATES, int(node.get("candidates") or 1)))
+    models = [str(node.get("model", ""))] + [m for m in node.get("candidate_models", []) if m]
+    temps = [float(node.get("temperature", 0.7))] + [float(t) for t in node.get("candidate_temperatures", [])]
+    return [{"model": models[i % len(models)], "temperature": temps[i % len(temps)]} for i in range(n)]
+
+
+def scorer_for(node: Dict[str, Any]) -> str:
+    # `keywords` without any keywords would score every candidate 0, so fall
+    # back to closeness to the length target
+    name = str(node.get("scorer") or "keywords")
+    if name not in SCORERS:
+        name = "keywords"
+    if name == "keywords" and not _keywords(node):
+        name = "length"
+    return name
+
+
+def pick_best(candidates: List[Dict[str, Any]], node: Dict[str, Any], ctx: Dict[str, Any] | None = None) -> int:
+    # Scores successful candidates in place; returns the winner's index (-1 if none).
+    # Ties keep the earliest candidate.
+    ctx = ctx or {}
+    name = scorer_for(node)
+    requested = str(node.get("scorer") or "keywords")
+    if name != requested:
+        log.warning("scorer %r unusable for node %r; using %r", requested, node.get("output_key"), name)
+    scorer = SCORERS[name]
+    ok = [c for c in candidates if c.get("error") is None]
+
+    def score(c: Dict[str, Any]) -> None:
+        c["scorer"] = name
+        try:
+            c["score"] = float(scorer(c.get("text", ""), node, ctx))
+        except Exception as e:  # noqa: BLE001
+            c["score"] = 0.0
+            c["score_error"] = str(e)
+
+    # Concurrent, so LLM judge calls overlap as far as the scheduler caps allow
+    with ThreadPoolExecutor(max_workers=max(1, len(ok))) as pool:
+        list(pool.map(score, ok))
+    best = -1
+    for i, c in enumerate(candidates):
+        if c.get("error") is None and (best < 0 or c["score"] > candidates[best]["score"]):
+            best = i
+    return best
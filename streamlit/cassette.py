@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+# Record/replay of provider calls for offline, deterministic runs.
+#
+#   PROVIDER_MODE=record  call providers and append every response to the cassette
+#   PROVIDER_MODE=replay  serve responses from the cassette; never touch the network
+#   REPLAY_SPEED=instant | recorded   (recorded sleeps to reproduce chunk timings)
+#   CASSETTE=path/to/file.jsonl       (default experiments/cassettes/default.jsonl)
+
+CASSETTE_DIR = Path(__file__).resolve().parent.parent / "experiments" / "cassettes"
+MODES = ("live", "record", "replay")
+
+
+def fingerprint(request: Dict[str, Any]) -> str:
+    # Stable hash of everything that determines a provider response
+    return hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:32]
+
+
+class CassetteMiss(RuntimeError):
+    pass
+
+
+class Cassette:
+    def __init__(self, path: Path, mode: str = "replay", speed: str = "instant") -> None:
+        self.path = Path(path)
+        self.mode = mode if mode in MODES else "live"
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursor: Dict[str, int] = {}
+        self._load()
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        for line in self.path.read_text(encoding="utf-8").splitlines():
+            try:
+                e = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(e, dict) and e.get("fp"):
+                self._entries.setdefault(str(e["fp"]), []).append(e)
+
+    def call(self, request: Dict[str, Any], fn: Callable[[], str]) -> str:
+        if self.mode == "replay":
+            return self._replay(request)
+        if self.mode != "record":
+            return fn()
+        t0 = time.monotonic()
+        out = fn()
+        latency_ms = (time.monotonic() - t0) * 1000
+        # generate() is non-streaming, so the whole response is one chunk at its latency
+        entry = {
+            "fp": fingerprint(request),
+            "request": request,
+            "response": out,
+            "chunks": [[round(latency_ms, 1), out]],
+            "latency_ms": round(latency_ms, 1),
+            "recorded_at": time.time(),
+        }
+        with self._lock:
+            self._entries.setdefault(entry["fp"], []).append(entry)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return out
+
+    def _replay(self, request: Dict[str, Any]) -> str:
+        fp = fingerprint(request)
+        with self._lock:
+            entries = self._entries.get(fp)
+            if not entries:
+                raise CassetteMiss(f"no cassette entry for {request.get('provider')}/{request.get('model')} (fp {fp}) in {self.path}")
+            # Repeated identical requests replay recorded responses in order, then stick on the last
+            i = self._cursor.get(fp, 0)
+            self._cursor[fp] = i + 1
+            entry = entries[min(i, len(entries) - 1)]
+        if self.speed != "recorded":
+            return str(entry.get("response", ""))
+        t0 = time.monotonic()
+        parts: List[str] = []
+        for offset_ms, text in entry.get("chunks") or [[entry.get("latency_ms", 0), entry.get("response", "")]]:
+            delay = float(offset_ms) / 1000 - (time.monotonic() - t0)
+            if delay > 0:
+                time.sleep(delay)
+            parts.append(str(text))
+        return "".join(parts)
+
+
+_CASSETTE: Cassette | None = None
+_CASSETTE_KEY: tuple | None = None
+_CASSETTE_LOCK = threading.Lock()
+
+
+def get_cassette() -> Cassette | None:
+    # None in live mode; rebuilt if the env settings change (e.g. .env.local edits)
+    global _CASSETTE, _CASSETTE_KEY
+    mode = os.getenv("PROVIDER_MODE", "live").strip().lower()
+    if mode not in ("record", "replay"):
+        return None
+    path = os.getenv("CASSETTE") or str(CASSETTE_DIR / "default.jsonl")
+    key = (mode, path, os.getenv("REPLAY_SPEED", "instant"))
+    with _CASSETTE_LOCK:
+        if _CASSETTE is None or _CASSETTE_KEY != key:
+            _CASSETTE = Cassette(Path(path), mode, key[2])
+            _CASSETTE_KEY = key
+        return _CASSETTE
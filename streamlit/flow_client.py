@@ -0,0 +1,50 @@
+import json
+import os
+import urllib.request
+from typing import Any, Dict, Iterator
+
+# Thin client for flow_service.py. Set FLOW_SERVICE_URL (e.g. http://127.0.0.1:8765)
+# to run flows on the shared service instead of in-process.
+
+
+def service_url() -> str | None:
+    url = os.getenv("FLOW_SERVICE_URL", "").strip()
+    return url.rstrip("/") or None
+
+
+def _request(method: str, path: str, payload: Dict[str, Any] | None = None, timeout: float = 30) -> Dict[str, Any]:
+    url = service_url()
+    if not url:
+        raise RuntimeError("FLOW_SERVICE_URL not set")
+    body = json.dumps(payload).encode("utf-8") if payload is not None else None
+    req = urllib.request.Request(f"{url}{path}", data=body, method=method, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=timeout) as res:
+        return json.loads(res.read() or b"{}")
+
+
+def submit_run(spec: Dict[str, Any]) -> str:
+    return str(_request("POST", "/runs", spec)["id"])
+
+
+def run_status(run_id: str) -> Dict[str, Any]:
+    return _request("GET", f"/runs/{run_id}")
+
+
+def cancel_run(run_id: str) -> Dict[str, Any]:
+    return _request("POST", f"/runs/{run_id}/cancel", {})
+
+
+def stream_run(run_id: str, timeout: float = 600) -> Iterator[Dict[str, Any]]:
+    # Yields service events ({"type": "node" | "draft" | "status", ...}) as they arrive
+    url = service_url()
+    if not url:
+        raise RuntimeError("FLOW_SERVICE_URL not set")
+    with urllib.request.urlopen(f"{url}/runs/{run_id}/stream", timeout=timeout) as res:
+        for line in res:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def service_metrics() -> Dict[str, Any]:
+    return _request("GET", "/metrics")
@@ -0,0 +1,272 @@
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+
+from utils import _normalize_step, get_execution_sequence, get_flow_graph, load_env, load_flows, run_nodes
+from scheduler import get_scheduler
+from similarity import get_index
+
+# Local flow-execution service. One process owns the worker pool, provider
+# clients, scheduler and caches; the Streamlit app and scripts talk to it over
+# HTTP/JSON (see flow_client.py).
+#
+#   POST /runs                 {"flow": name} or {"nodes": [...], "edges": [...]},
+#                              optional "variables", "deadline" (defaults to the
+#                              saved flow's), "user", "priority"; 400 if malformed
+#   GET  /runs/<id>            status, progress ("done", "draft"), outputs, errors, skipped
+#   GET  /runs/<id>/stream     NDJSON events until the run finishes
+#   POST /runs/<id>/cancel     stop before the next node; outputs so far are kept
+#   GET  /health, /metrics
+
+FINISHED = ("done", "cancelled", "failed")
+MAX_RUNS = 200
+
+
+class FlowRun:
+    def __init__(self, nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]], spec: Dict[str, Any]) -> None:
+        self.id = uuid.uuid4().hex[:12]
+        self.nodes = nodes
+        self.edges = edges
+        self.spec = spec
+        self.status = "queued"
+        self.result: Dict[str, Any] = {}
+        self.events: List[Dict[str, Any]] = []
+        self.cancel = threading.Event()
+        self.cond = threading.Condition()
+        self.created = time.time()
+        self.finished: float | None = None
+        # Progress for pollers: per-node status and the latest similar-prompt draft
+        self.done: Dict[str, str] = {}
+        self.draft: Dict[str, Any] | None = None
+
+    def emit(self, event: Dict[str, Any]) -> None:
+        with self.cond:
+            self.events.append({"ts": time.time(), **event})
+            if event.get("type") == "node":
+                self.done[str(event.get("key"))] = str(event.get("status"))
+                if self.draft and self.draft.get("key") == event.get("key"):
+                    self.draft = None
+            elif event.get("type") == "draft":
+                self.draft = {k: event.get(k) for k in ("key", "text", "score")}
+            self.cond.notify_all()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.cond:
+            return {
+                "id": self.id,
+                "status": self.status,
+                "created": self.created,
+                "finished": self.finished,
+                "nodes": [n.get("output_key") for n in self.nodes],
+                "done": dict(self.done),
+                "draft": self.draft,
+                **self.result,
+            }
+
+
+class FlowService:
+    def __init__(self, workers: int = 4) -> None:
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="flow")
+        self.runs: Dict[str, FlowRun] = {}
+        self.lock = threading.Lock()
+
+    def _resolve(self, spec: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]] | None, float]:
+        # (nodes, edges, default deadline); raises ValueError/KeyError for a bad spec
+        if "nodes" in spec:
+            nodes, edges = spec["nodes"], spec.get("edges")
+            if not isinstance(nodes, list) or not nodes or not all(isinstance(n, dict) for n in nodes):
+                raise ValueError("nodes must be a non-empty list of objects")
+            if edges is not None and not (
+                isinstance(edges, list) and all(isinstance(e, dict) and "source" in e and "target" in e for e in edges)
+            ):
+                raise ValueError("edges must be a list of {source, target} objects")
+            try:
+                resolved = [{**_normalize_step(n, i), "id": int(n.get("id", i + 1))} for i, n in enumerate(nodes)]
+                for e in edges or []:
+                    int(e["source"]), int(e["target"])
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"invalid node or edge: {e}") from e
+            return resolved, edges, 0.0
+        data = load_flows()
+        name = str(spec.get("flow") or data.get("active", "Blog"))
+        flow = next((f for f in data.get("flows", []) if f.get("name") == name), None)
+        if flow is None:
+            raise KeyError(f"unknown flow: {name}")
+        _, edges = get_flow_graph(flow)
+        return get_execution_sequence(flow), edges, float(flow.get("deadline") or 0)
+
+    def submit(self, spec: Dict[str, Any]) -> FlowRun:
+        nodes, edges, deadline = self._resolve(spec)
+        if not isinstance(spec.get("variables", {}), dict):
+            raise ValueError("variables must be an object")
+        try:
+            # A posted deadline overrides the saved flow's (0 = none)
+            spec = {**spec, "deadline": float(spec["deadline"]) if spec.get("deadline") is not None else deadline}
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"invalid deadline: {e}") from e
+        run = FlowRun(nodes, edges or [{"source": i, "target": i + 1} for i in range(1, len(nodes))], spec)
+        with self.lock:
+            self.runs[run.id] = run
+            # Forget the oldest finished runs
+            done = [r for r in self.runs.values() if r.status in FINISHED]
+            for r in sorted(done, key=lambda r: r.created)[: max(0, len(self.runs) - MAX_RUNS)]:
+                del self.runs[r.id]
+        self.pool.submit(self._execute, run)
+        return run
+
+    def _execute(self, run: FlowRun) -> None:
+        if run.cancel.is_set():
+            self._finish(run, "cancelled", {"skipped": [n.get("output_key") for n in run.nodes]})
+            return
+        with run.cond:
+            run.status = "running"
+        run.emit({"type": "status", "status": "running"})
+        spec = run.spec
+        try:
+            res = run_nodes(
+                run.nodes,
+                run.edges,
+                deadline_s=float(spec.get("deadline") or 0) or None,
+                variables=spec.get("variables") or {},
+                priority=str(spec.get("priority", "batch")),
+                user=str(spec.get("user") or "service"),
+                on_draft=lambda k, text, score: run.emit({"type": "draft", "key": k, "text": text, "score": score}),
+                on_node=lambda k, status, text: run.emit({"type": "node", "key": k, "status": status, "text": text}),
+                cancel=run.cancel,
+            )
+        except Exception as e:  # noqa: BLE001
+            self._finish(run, "failed", {"error": str(e)})
+            return
+        self._finish(run, "cancelled" if res.get("cancelled") else "done", res)
+
+    def _finish(self, run: FlowRun, status: str, result: Dict[str, Any]) -> None:
+        with run.cond:
+            run.status = status
+            run.result = result
+            run.finished = time.time()
+        run.emit({"type": "status", "status": status, **result})
+
+    def get(self, run_id: str) -> FlowRun | None:
+        with self.lock:
+            return self.runs.get(run_id)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self.lock:
+            by_status: Dict[str, int] = {}
+            for r in self.runs.values():
+                by_status[r.status] = by_status.get(r.status, 0) + 1
+        return {"runs": by_status, "scheduler": get_scheduler().metrics(), "similarity": get_index().metrics()}
+
+
+SERVICE: FlowService | None = None
+
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = "FlowService/1.0"
+
+    def _json(self, code: int, payload: Any) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _run_or_404(self, run_id: str) -> FlowRun | None:
+        run = SERVICE.get(run_id) if SERVICE else None
+        if run is None:
+            self._json(404, {"error": f"unknown run: {run_id}"})
+        return run
+
+    def do_GET(self) -> None:  # noqa: N802
+        parts = [p for p in self.path.split("?")[0].split("/") if p]
+        if parts == ["health"]:
+            self._json(200, {"ok": True})
+        elif parts == ["metrics"]:
+            self._json(200, SERVICE.metrics() if SERVICE else {})
+        elif len(parts) == 2 and parts[0] == "runs":
+            run = self._run_or_404(parts[1])
+            if run is not None:
+                self._json(200, run.snapshot())
+        elif len(parts) == 3 and parts[0] == "runs" and parts[2] == "stream":
+            run = self._run_or_404(parts[1])
+            if run is not None:
+                self._stream(run)
+        else:
+            self._json(404, {"error": "not found"})
+
+    def do_POST(self) -> None:  # noqa: N802
+        parts = [p for p in self.path.split("?")[0].split("/") if p]
+        if parts == ["runs"]:
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                spec = json.loads(self.rfile.read(length) or b"{}")
+                if not isinstance(spec, dict):
+                    raise ValueError("body must be a JSON object")
+                run = SERVICE.submit(spec)  # type: ignore[union-attr]
+            except (KeyError, ValueError) as e:
+                self._json(400, {"error": str(e)})
+                return
+            self._json(202, {"id": run.id, "status": run.status})
+        elif len(parts) == 3 and parts[0] == "runs" and parts[2] == "cancel":
+            run = self._run_or_404(parts[1])
+            if run is not None:
+                run.cancel.set()
+                self._json(202, {"id": run.id, "status": run.status})
+        else:
+            self._json(404, {"error": "not found"})
+
+    def _stream(self, run: FlowRun) -> None:
+        # Newline-delimited JSON; the connection closes when the run finishes
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        sent = 0
+        while True:
+            with run.cond:
+                while sent >= len(run.events) and run.status not in FINISHED:
+                    run.cond.wait(15)
+                batch = run.events[sent:]
+                finished = run.status in FINISHED
+            for ev in batch:
+                self.wfile.write((json.dumps(ev) + "\n").encode("utf-8"))
+            self.wfile.flush()
+            sent += len(batch)
+            if finished and sent >= len(run.events):
+                return
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        if os.getenv("FLOW_SERVICE_LOG"):
+            super().log_message(format, *args)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Local flow-execution service")
+    parser.add_argument("--host", default=os.getenv("FLOW_SERVICE_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("FLOW_SERVICE_PORT", "8765")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("FLOW_SERVICE_WORKERS", "4")))
+    args = parser.parse_args()
+    load_env()
+    global SERVICE
+    SERVICE = FlowService(args.workers)
+    httpd = ThreadingHTTPServer((args.host, args.port), Handler)
+    httpd.daemon_threads = True
+    print(f"Flow service on http://{args.host}:{args.port} ({args.workers} workers)")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,296 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, TypeVar
+
+T = TypeVar("T")
+
+# Lower value runs first
+PRIORITIES = {"test": 0, "flow": 1, "batch": 2}
+
+
+def _parse_weights(raw: str) -> Dict[str, float]:
+    # "alice=2,bob=0.5" -> {"alice": 2.0, "bob": 0.5}
+    out: Dict[str, float] = {}
+    for part in (raw or "").split(","):
+        name, _, val = part.partition("=")
+        try:
+            if name.strip() and float(val) > 0:
+                out[name.strip()] = float(val)
+        except ValueError:
+            continue
+    return out
+
+
+class _Ticket:
+    __slots__ = ("user", "provider", "priority", "prio", "start", "finish", "seq", "enqueued")
+
+    def __init__(self, user: str, provider: str, priority: str, start: float, finish: float, seq: int) -> None:
+        self.user = user
+        self.provider = provider
+        self.priority = priority
+        self.prio = PRIORITIES[priority]
+        self.start = start
+        self.finish = finish
+        self.seq = seq
+        self.enqueued = time.monotonic()
+
+
+class Scheduler:
+    # Priority classes first, then per-user weighted fair queuing (virtual finish
+    # time) within a class; per-user and per-provider in-flight caps gate dispatch.
+
+    def __init__(self, max_inflight_user: int = 2, max_inflight_provider: int = 4, weights: Dict[str, float] | None = None) -> None:
+        self.max_inflight_user = max(1, int(max_inflight_user))
+        self.max_inflight_provider = max(1, int(max_inflight_provider))
+        self.weights: Dict[str, float] = dict(weights or {})
+        self._cv = threading.Condition()
+        self._waiting: List[_Ticket] = []
+        self._inflight_user: Dict[str, int] = {}
+        self._inflight_provider: Dict[str, int] = {}
+        self._last_finish: Dict[str, float] = {}
+        self._vtime = 0.0
+        self._seq = 0
+        self._waits: Dict[str, Deque[float]] = {p: deque(maxlen=500) for p in PRIORITIES}
+        self._served: Dict[str, int] = {p: 0 for p in PRIORITIES}
+        self._timeouts = 0
+        self._abandoned = 0
+
+    def set_weight(self, user: str, weight: float) -> None:
+        with self._cv:
+            if weight > 0:
+                self.weights[user] = float(weight)
+
+    def _eligible(self, t: _Ticket) -> bool:
+        return (
+            self._inflight_user.get(t.user, 0) < self.max_inflight_user
+            and self._inflight_provider.get(t.provider, 0) < self.max_inflight_provider
+        )
+
+    def _head(self) -> _Ticket | None:
+        best: _Ticket | None = None
+        for t in self._waiting:
+            if not self._eligible(t):
+                continue
+            if best is None or (t.prio, t.finish, t.seq) < (best.prio, best.finish, best.seq):
+                best = t
+        return best
+
+    def _enqueue(self, user: str, provider: str, priority: str) -> _Ticket:
+        # Caller holds _cv
+        start = max(self._vtime, self._last_finish.get(user, 0.0))
+        finish = start + 1.0 / self.weights.get(user, 1.0)
+        self._last_finish[user] = finish
+        self._seq += 1
+        ticket = _Ticket(user, provider, priority, start, finish, self._seq)
+        self._waiting.append(ticket)
+        return ticket
+
+    def _dispatch(self, ticket: _Ticket) -> None:
+        # Caller holds _cv; the ticket is the eligible head
+        self._waiting.remove(ticket)
+        self._vtime = max(self._vtime, ticket.start)
+        self._inflight_user[ticket.user] = self._inflight_user.get(ticket.user, 0) + 1
+        self._inflight_provider[ticket.provider] = self._inflight_provider.get(ticket.provider, 0) + 1
+        self._waits[ticket.priority].append(time.monotonic() - ticket.enqueued)
+        self._served[ticket.priority] += 1
+        # Others may now be eligible under a different head
+        self._cv.notify_all()
+
+    def _abandon(self, ticket: _Ticket, timed_out: bool = True) -> None:
+        # Caller holds _cv
+        self._waiting.remove(ticket)
+        if timed_out:
+            self._timeouts += 1
+        self._cv.notify_all()
+
+    def admit(self, *, user: str = "default", provider: str = "groq", priority: str = "batch", max_wait: float | None = None, slots: int = 1) -> "Admission":
+        # Wait for one dispatch slot. An admission for a group of calls (e.g. a
+        # node's candidates) starts with that slot and queues for more, one
+        # ticket per slot, as its calls need them, up to `slots`; every slot
+        # counts against both the per-user and the per-provider cap.
+        if priority not in PRIORITIES:
+            priority = "batch"
+        provider = provider.lower()
+        with self._cv:
+            ticket = self._enqueue(user, provider, priority)
+            t_end = None if max_wait is None else ticket.enqueued + max_wait
+            while self._head() is not ticket:
+                remaining = None if t_end is None else t_end - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._abandon(ticket)
+                    raise TimeoutError(f"scheduler queue wait exceeded {max_wait:.1f}s")
+                self._cv.wait(remaining)
+            self._dispatch(ticket)
+        return Admission(self, user, provider, priority, max(1, int(slots)))
+
+    def run(self, fn: Callable[[], T], *, user: str = "default", provider: str = "groq", priority: str = "batch", max_wait: float | None = None, timeout: float | None = None) -> T:
+        admission = self.admit(user=user, provider=provider, priority=priority, max_wait=max_wait)
+        try:
+            return admission.call(fn, timeout)
+        finally:
+            admission.close()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._cv:
+            depth: Dict[str, int] = {p: 0 for p in PRIORITIES}
+            by_provider: Dict[str, int] = {}
+            for t in self._waiting:
+                depth[t.priority] += 1
+                by_provider[t.provider] = by_provider.get(t.provider, 0) + 1
+            waits: Dict[str, Dict[str, float]] = {}
+            for name, w in self._waits.items():
+                s = sorted(w)
+                waits[name] = {
+                    "served": self._served[name],
+                    "avg_ms": (sum(s) / len(s) * 1000) if s else 0.0,
+                    "p95_ms": (s[min(len(s) - 1, int(len(s) * 0.95))] * 1000) if s else 0.0,
+                }
+            return {
+                "queue_depth": depth,
+                "queue_depth_by_provider": by_provider,
+                "inflight_by_user": {k: v for k, v in self._inflight_user.items() if v},
+                "inflight_by_provider": {k: v for k, v in self._inflight_provider.items() if v},
+                "wait": waits,
+                "queue_timeouts": self._timeouts,
+                # Timed-out calls whose threads still hold their provider slot
+                "abandoned_calls": self._abandoned,
+            }
+
+
+class Admission:
+    # Slots granted by Scheduler.admit(). One slot is held while the admission is
+    # open; extra slots (up to max_slots) are queued for fairly when calls need
+    # them and handed back when those calls end. A slot stays held until its
+    # call actually exits, including calls abandoned after a timeout: a hung
+    # request still counts against the quota.
+
+    def __init__(self, sched: Scheduler, user: str, provider: str, priority: str, max_slots: int = 1) -> None:
+        self.sched = sched
+        self.user = user
+        self.provider = provider
+        self.priority = priority
+        self.max_slots = max_slots
+        self._held = 1
+        self._busy = 0
+        self._pending = 0
+        self._open = True
+
+    def _sync(self) -> None:
+        # Caller holds sched._cv: return slots no running call needs, keeping
+        # one while open
+        keep = max(self._busy, 1) if self._open else self._busy
+        if self._held > keep:
+            n = self._held - keep
+            self.sched._inflight_user[self.user] -= n
+            self.sched._inflight_provider[self.provider] -= n
+            self._held = keep
+        self.sched._cv.notify_all()
+
+    def _acquire(self, until: float | None) -> None:
+        # Take a held idle slot, or queue one more ticket if under max_slots
+        sched = self.sched
+        ticket: _Ticket | None = None
+        timed_out = False
+        with sched._cv:
+            try:
+                while True:
+                    if self._busy < self._held:
+                        self._busy += 1
+                        return
+                    if ticket is None and self._held + self._pending < self.max_slots:
+                        ticket = sched._enqueue(self.user, self.provider, self.priority)
+                        self._pending += 1
+                    if ticket is not None and sched._head() is ticket:
+                        sched._dispatch(ticket)
+                        ticket = None
+                        self._pending -= 1
+                        self._held += 1
+                        self._busy += 1
+                        return
+                    remaining = None if until is None else until - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        timed_out = True
+                        raise TimeoutError("no free slot before the deadline")
+                    sched._cv.wait(remaining)
+            finally:
+                # Withdraw a ticket that lost to a freed slot or ran out of time
+                if ticket is not None:
+                    sched._abandon(ticket, timed_out)
+                    self._pending -= 1
+
+    def call(self, fn: Callable[[], T], timeout: float | None = None, until: float | None = None) -> T:
+        # Run fn in one of this admission's slots. With a timeout, fn runs on a
+        # daemon thread that is abandoned (result discarded) if it overruns; its
+        # slot is released only when that thread actually exits. Waiting for a
+        # slot counts against the timeout, unless `until` (a time.monotonic()
+        # deadline) is given: then the wait is bounded by it and the timeout
+        # starts once the slot is acquired, still ending by `until`.
+        if until is not None:
+            self._acquire(until)
+            left = until - time.monotonic()
+            timeout = max(0.001, min(timeout, left) if timeout else left)
+        else:
+            self._acquire(time.monotonic() + timeout if timeout else None)
+        t_end = None if not timeout else time.monotonic() + timeout
+        box: Dict[str, Any] = {}
+
+        def done() -> None:
+            with self.sched._cv:
+                box["finished"] = True
+                self._busy -= 1
+                if box.get("abandoned"):
+                    self.sched._abandoned -= 1
+                self._sync()
+
+        if t_end is None:
+            try:
+                return fn()
+            finally:
+                done()
+
+        def target() -> None:
+            try:
+                box["out"] = fn()
+            except BaseException as e:  # noqa: BLE001
+                box["err"] = e
+            finally:
+                done()
+
+        t = threading.Thread(target=target, daemon=True)
+        t.start()
+        t.join(max(0.001, t_end - time.monotonic()))
+        with self.sched._cv:
+            if not box.get("finished"):
+                box["abandoned"] = True
+                self.sched._abandoned += 1
+        if box.get("abandoned"):
+            raise TimeoutError(f"provider call exceeded {timeout:.1f}s timeout")
+        if "err" in box:
+            raise box["err"]
+        return box["out"]
+
+    def close(self) -> None:
+        with self.sched._cv:
+            if self._open:
+                self._open = False
+                self._sync()
+
+
+_SCHEDULER: Scheduler | None = None
+_SCHEDULER_LOCK = threading.Lock()
+
+
+def get_scheduler() -> Scheduler:
+    # Process-wide scheduler shared by every Streamlit session and script in this
+    # process; built lazily so limits from .env/.env.local are picked up.
+    global _SCHEDULER
+    with _SCHEDULER_LOCK:
+        if _SCHEDULER is None:
+            _SCHEDULER = Scheduler(
+                max_inflight_user=int(os.getenv("SCHED_MAX_INFLIGHT_USER", "2")),
+                max_inflight_provider=int(os.getenv("SCHED_MAX_INFLIGHT_PROVIDER", "4")),
+                weights=_parse_weights(os.getenv("SCHED_USER_WEIGHTS", "")),
+            )
+        return _SCHEDULER
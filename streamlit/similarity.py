@@ -0,0 +1,243 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from cassette import get_cassette
+
+log = logging.getLogger(__name__)
+
+# Append-only JSONL log of entries; rewritten with only the live entries once it
+# holds COMPACT_EVERY more lines than that
+INDEX_FILE = Path(__file__).resolve().parent / ".streamlit" / "similarity_index.jsonl"
+# One JSONL record per lookup (hit/miss, score, running hit rate); rotated to
+# .1 once it passes STATS_MAX_BYTES
+STATS_FILE = INDEX_FILE.with_name("similarity_stats.jsonl")
+STATS_MAX_BYTES = 5 * 1024 * 1024
+
+# 64 permutations split into 16 LSH bands of 4 rows: near-certain recall at
+# Jaccard >= 0.8, while unrelated prompts rarely share a bucket.
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+MAX_ENTRIES = 2000
+COMPACT_EVERY = 500
+_PRIME = (1 << 61) - 1
+_rng = random.Random(1)
+_PERMS: List[Tuple[int, int]] = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+
+def _shingles(text: str, k: int = 3) -> set:
+    # Case/whitespace-insensitive word k-grams taken line by line, so reordered
+    # bullets keep their shingles
+    out: set = set()
+    for line in (text or "").lower().splitlines():
+        words = re.findall(r"\w+", line)
+        if 0 < len(words) < k:
+            out.add(" ".join(words))
+        out.update(" ".join(words[i : i + k]) for i in range(len(words) - k + 1))
+    return out
+
+
+def informative(text: str) -> bool:
+    # Empty or punctuation-only prompts have no shingles and would all match each other
+    return bool(_shingles(text))
+
+
+def minhash(text: str) -> List[int]:
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big") for s in _shingles(text)]
+    if not hashes:
+        return [_PRIME] * NUM_PERM
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMS]
+
+
+def similarity(sig_a: List[int], sig_b: List[int]) -> float:
+    # Estimated Jaccard similarity of the underlying shingle sets
+    if not sig_a or len(sig_a) != len(sig_b):
+        return 0.0
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+
+def _band_keys(sig: List[int]) -> List[str]:
+    return [f"{b}:{hash(tuple(sig[b * ROWS : (b + 1) * ROWS]))}" for b in range(BANDS)]
+
+
+class SimilarityIndex:
+    # Local MinHash LSH index of rendered prompts -> outputs, scoped per node/model.
+
+    def __init__(self, path: Path = INDEX_FILE, stats_path: Path | None = STATS_FILE) -> None:
+        self.path = path
+        self.stats_path = stats_path
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._entries: List[Dict[str, Any]] = []
+        self._buckets: Dict[str, Dict[str, List[int]]] = {}
+        self.stats = {"lookups": 0, "hits": 0}
+        self._lines = 0
+        self._added = 0
+        self._compacting = False
+        self._load()
+
+    def _load(self) -> None:
+        self._lines = 0
+        try:
+            lines = self.path.read_text(encoding="utf-8").splitlines()
+        except Exception:
+            lines = []
+        for line in lines:
+            self._lines += 1
+            try:
+                e = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(e, dict) and isinstance(e.get("sig"), list) and len(e["sig"]) == NUM_PERM:
+                self._entries.append(e)
+        self._entries = self._entries[-MAX_ENTRIES:]
+        self._reindex()
+
+    def _reindex(self) -> None:
+        self._buckets = {}
+        for idx, e in enumerate(self._entries):
+            scoped = self._buckets.setdefault(str(e.get("scope", "")), {})
+            for key in _band_keys(e["sig"]):
+                scoped.setdefault(key, []).append(idx)
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        # Caller holds the lock; one line per entry keeps writes small
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+            self._lines += 1
+        except Exception as e:  # noqa: BLE001
+            log.warning("similarity index append failed: %s", e)
+
+    def _record(self, record: Dict[str, Any]) -> None:
+        if self.stats_path is None:
+            return
+        try:
+            with self._stats_lock:
+                self.stats_path.parent.mkdir(parents=True, exist_ok=True)
+                if self.stats_path.exists() and self.stats_path.stat().st_size > STATS_MAX_BYTES:
+                    os.replace(self.stats_path, self.stats_path.with_name(self.stats_path.name + ".1"))
+                with self.stats_path.open("a", encoding="utf-8") as f:
+                    f.write(json.dumps({"ts": time.time(), **record}) + "\n")
+        except Exception as e:  # noqa: BLE001
+            log.warning("similarity stats append failed: %s", e)
+
+    def _compact(self) -> None:
+        # Rewrite the log with live entries only. The snapshot is written outside
+        # the lock; entries appended meanwhile are carried over before the swap.
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+            snapshot = list(self._entries)
+            added_at = self._added
+        tmp = self.path.with_suffix(".tmp")
+        try:
+            tmp.write_text("".join(json.dumps(e) + "\n" for e in snapshot), encoding="utf-8")
+            with self._lock:
+                n_new = self._added - added_at
+                extra = self._entries[-n_new:] if n_new else []
+                with tmp.open("a", encoding="utf-8") as f:
+                    for e in extra:
+                        f.write(json.dumps(e) + "\n")
+                os.replace(tmp, self.path)
+                self._lines = len(snapshot) + len(extra)
+        except Exception as e:  # noqa: BLE001
+            log.warning("similarity index compaction failed: %s", e)
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def lookup(self, scope: str, prompt: str, threshold: float) -> Tuple[str, float] | None:
+        if not informative(prompt):
+            return None
+        sig = minhash(prompt)
+        with self._lock:
+            self.stats["lookups"] += 1
+            scoped = self._buckets.get(scope, {})
+            candidates = {i for key in _band_keys(sig) for i in scoped.get(key, [])}
+            best: Tuple[str, float] | None = None
+            for i in candidates:
+                score = similarity(sig, self._entries[i]["sig"])
+                if score >= threshold and (best is None or score > best[1]):
+                    best = (str(self._entries[i].get("output", "")), score)
+            if best is not None:
+                self.stats["hits"] += 1
+            rate = self.stats["hits"] / self.stats["lookups"]
+        # The Streamlit app leaves non-streamlit loggers at WARNING, so the stats
+        # file is the durable record; the log line helps when logging is configured
+        self._record(
+            {
+                "scope": scope,
+                "hit": best is not None,
+                "score": round(best[1], 4) if best is not None else None,
+                "threshold": threshold,
+                "candidates": len(candidates),
+                "hit_rate": round(rate, 4),
+            }
+        )
+        if best is not None:
+            log.info("similarity hit scope=%s score=%.3f hit_rate=%.2f", scope, best[1], rate)
+        else:
+            log.info("similarity miss scope=%s candidates=%d hit_rate=%.2f", scope, len(candidates), rate)
+        return best
+
+    def add(self, scope: str, prompt: str, output: str) -> None:
+        if not (output or "").strip() or not informative(prompt):
+            return
+        entry = {"scope": scope, "sig": minhash(prompt), "output": output, "ts": time.time()}
+        with self._lock:
+            self._entries.append(entry)
+            if len(self._entries) > MAX_ENTRIES:
+                self._entries = self._entries[-MAX_ENTRIES:]
+                self._reindex()
+            else:
+                scoped = self._buckets.setdefault(scope, {})
+                for key in _band_keys(entry["sig"]):
+                    scoped.setdefault(key, []).append(len(self._entries) - 1)
+            self._added += 1
+            self._append(entry)
+            stale = self._lines - len(self._entries) >= COMPACT_EVERY
+        if stale:
+            self._compact()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats["lookups"]
+            return {
+                "entries": len(self._entries),
+                "lookups": lookups,
+                "hits": self.stats["hits"],
+                "hit_rate": (self.stats["hits"] / lookups) if lookups else 0.0,
+            }
+
+
+_INDEX: SimilarityIndex | None = None
+_INDEX_LOCK = threading.Lock()
+
+
+def get_index() -> SimilarityIndex:
+    global _INDEX
+    with _INDEX_LOCK:
+        if _INDEX is None:
+            _INDEX = SimilarityIndex()
+        return _INDEX
+
+
+def reuse_enabled() -> bool:
+    # Off while a cassette records or replays: a recording must hold every call a
+    # replay will make, and replays must not depend on (or change) the local index
+    return get_cassette() is None
+
+
+def scope_for(node: Dict[str, Any]) -> str:
+    return f"{node.get('output_key', '')}|{str(node.get('provider', 'Groq')).lower()}|{node.get('model', '')}"
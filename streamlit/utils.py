@@ -1,12 +1,22 @@
 import os
+import time
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
-from typing import Any, Dict, List, Tuple
+from typing import Any, Callable, Dict, List, Tuple
 import json
 
 from dotenv import load_dotenv
 import streamlit as st
 
+from scheduler import Admission, get_scheduler
+from similarity import get_index, reuse_enabled, scope_for
+from cassette import get_cassette
+from candidates import MAX_CANDIDATES, SCORERS, candidate_settings, judge_provider, pick_best, scorer_for
+from budget import COMPACTION_STRATEGIES, context_window, estimate_tokens, fit_variables
+
 try:
     from groq import Groq  # type: ignore
 except Exception:  # pragma: no cover
@@ -24,6 +34,9 @@ PROMPTS_FILE = REPO_ROOT / "streamlit" / ".streamlit" / "prompts.json"
 FLOW_FILE_LEGACY = REPO_ROOT / "streamlit" / ".streamlit" / "flow.json"
 FLOWS_FILE = REPO_ROOT / "streamlit" / ".streamlit" / "flows.json"
 
+# A node whose share of the flow deadline is below this is skipped, not started
+MIN_NODE_BUDGET_S = 1.0
+
 
 def load_env() -> None:
     # Use override=True so edits to .env.local take effect on rerun
@@ -31,6 +44,15 @@ def load_env() -> None:
     load_dotenv(REPO_ROOT / ".env.local", override=True)
 
 
+def default_timeout() -> float:
+    # Per-node provider timeout (seconds) when a step does not set one; read on use
+    # so NODE_TIMEOUT_S from .env/.env.local (loaded after import) applies
+    try:
+        return float(os.getenv("NODE_TIMEOUT_S", "60"))
+    except ValueError:
+        return 60.0
+
+
 def get_secret(name: str) -> str | None:
     try:
         if name in st.secrets:
@@ -46,13 +68,36 @@ def get_default_model(provider: str) -> str:
     return os.getenv("GEMINI_DEFAULT_MODEL", "gemini-2.0-flash")
 
 
-def run_groq(prompt: str, system: str | None, model: str, temperature: float, max_tokens: int, top_p: float) -> str:
+# Provider clients are created once per API key and shared across calls/threads
+_CLIENTS: Dict[str, Any] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def _groq_client(api_key: str) -> Any:
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(f"groq:{api_key}")
+        if client is None:
+            client = _CLIENTS[f"groq:{api_key}"] = Groq(api_key=api_key)
+        return client
+
+
+def _configure_gemini(api_key: str) -> None:
+    with _CLIENTS_LOCK:
+        if _CLIENTS.get("gemini") != api_key:
+            genai.configure(api_key=api_key)
+            _CLIENTS["gemini"] = api_key
+
+
+def run_groq(prompt: str, system: str | None, model: str, temperature: float, max_tokens: int, top_p: float, timeout: float | None = None) -> str:
     api_key = get_secret("GROQ_API_KEY")
     if not api_key:
         raise RuntimeError("GROQ_API_KEY not set in environment or Streamlit secrets")
     if Groq is None:
         raise RuntimeError("groq package not installed. Run: pip install -r streamlit/requirements.txt")
-    client = Groq(api_key=api_key)
+    # No SDK retries under a timeout: a retry would overrun the node's budget
+    client = _groq_client(api_key)
+    if timeout:
+        client = client.with_options(timeout=timeout, max_retries=0)
     messages = ([] if not system else [{"role": "system", "content": system}]) + [
         {"role": "user", "content": prompt}
     ]
@@ -66,13 +111,13 @@ def run_groq(prompt: str, system: str | None, model: str, temperature: float, ma
     return (res.choices[0].message.content or "").strip()
 
 
-def run_gemini(prompt: str, system: str | None, model: str, temperature: float, max_tokens: int, top_p: float) -> str:
+def run_gemini(prompt: str, system: str | None, model: str, temperature: float, max_tokens: int, top_p: float, timeout: float | None = None) -> str:
     api_key = get_secret("GEMINI_API_KEY")
     if not api_key:
         raise RuntimeError("GEMINI_API_KEY not set in environment or Streamlit secrets")
     if genai is None:
         raise RuntimeError("google-generativeai not installed. Run: pip install -r streamlit/requirements.txt")
-    genai.configure(api_key=api_key)
+    _configure_gemini(api_key)
     mm = genai.GenerativeModel(model_name=model, system_instruction=system)
     res = mm.generate_content(
         prompt,
@@ -81,6 +126,7 @@ def run_gemini(prompt: str, system: str | None, model: str, temperature: float,
             "max_output_tokens": int(max_tokens),
             "top_p": float(top_p),
         },
+        request_options={"timeout": float(timeout)} if timeout else None,
     )
     text = ""
     try:
@@ -102,10 +148,95 @@ def run_gemini(prompt: str, system: str | None, model: str, temperature: float,
     return (text or "").strip()
 
 
-def generate(provider: str, prompt: str, system: str | None, model: str, temperature: float, max_tokens: int, top_p: float) -> str:
-    if provider.lower() == "groq":
-        return run_groq(prompt, system, model, temperature, max_tokens, top_p)
-    return run_gemini(prompt, system, model, temperature, max_tokens, top_p)
+def generate(
+    provider: str,
+    prompt: str,
+    system: str | None,
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    top_p: float,
+    timeout: float | None = None,
+    user: str | None = None,
+    priority: str = "batch",
+    admission: Admission | None = None,
+    sample: int | None = None,
+    until: float | None = None,
+) -> str:
+    # Every provider call is admitted by the shared scheduler; queue wait counts
+    # against the same timeout as the call itself. Pass an existing admission to
+    # run inside slots already granted (e.g. a node's candidates); with `until`
+    # the timeout then starts once one of its slots is free (see Admission.call).
+    # `sample` tells apart otherwise identical candidate requests in a cassette.
+    t_end = time.monotonic() + timeout if timeout and until is None else None
+    own = admission is None
+    if admission is None:
+        admission = get_scheduler().admit(user=user or current_user(), provider=provider, priority=priority, max_wait=timeout)
+    try:
+        left = timeout if t_end is None else max(0.001, t_end - time.monotonic())
+        if provider.lower() == "groq":
+            fn = lambda: run_groq(prompt, system, model, temperature, max_tokens, top_p, left)  # noqa: E731
+        else:
+            fn = lambda: run_gemini(prompt, system, model, temperature, max_tokens, top_p, left)  # noqa: E731
+        cassette = get_cassette()
+        if cassette is not None:
+            # Record or replay (PROVIDER_MODE); replay never reaches the provider
+            request = {
+                "provider": provider.lower(),
+                "model": model,
+                "system": system,
+                "prompt": prompt,
+                "temperature": float(temperature),
+                "max_tokens": int(max_tokens),
+                "top_p": float(top_p),
+            }
+            if sample is not None:
+                request["sample"] = int(sample)
+            live = fn
+            fn = lambda: cassette.call(request, live)  # noqa: E731
+        # The slot is held until the call's thread exits, even after a timeout
+        return str(admission.call(fn, left, until))
+    finally:
+        if own:
+            admission.close()
+
+
+def _script_context() -> Any:
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+        return get_script_run_ctx()
+    except Exception:
+        return None
+
+
+def login_user() -> str | None:
+    # Email of the Streamlit-authenticated user (st.user / st.experimental_user), if any
+    info = getattr(st, "user", None) or getattr(st, "experimental_user", None)
+    try:
+        if info is not None and info.get("is_logged_in", True) and info.get("email"):
+            return str(info.get("email"))
+    except Exception:
+        pass
+    return None
+
+
+def current_user() -> str:
+    # Scheduler identity, matched against SCHED_USER_WEIGHTS:
+    # - Streamlit session: the logged-in email, else the name set in the app
+    #   ("user_name"), else an anonymous per-session id that never gets a weight.
+    # - Scripts and worker threads (no session): FLOW_USER, else "default".
+    if _script_context() is None:
+        return os.getenv("FLOW_USER") or "default"
+    email = login_user()
+    if email:
+        return email
+    name = str(st.session_state.get("user_name") or "").strip()
+    if name:
+        return name
+    if "anon_id" not in st.session_state:
+        st.session_state["anon_id"] = f"anon-{uuid.uuid4().hex[:8]}"
+    return str(st.session_state["anon_id"])
 
 
 def sanitize_filename(name: str) -> str:
@@ -241,9 +372,34 @@ def _default_step_params(provider: str | None = None) -> Dict[str, Any]:
         "temperature": 0.7,
         "max_tokens": 1200,
         "top_p": 1.0,
+        "timeout": 0.0,
+        "similar_threshold": 0.0,
+        "similar_mode": "reuse",
+        "input_budget": 0,
+        "compaction": "truncate",
+        "candidates": 1,
+        "candidate_models": [],
+        "candidate_temperatures": [],
+        "scorer": "keywords",
+        "keywords": "",
+        "target_words": 0,
     }
 
 
+def _split_list(value: Any) -> List[str]:
+    # Accept a JSON list or a comma-separated string
+    items = value if isinstance(value, list) else str(value or "").split(",")
+    return [str(v).strip() for v in items if str(v).strip()]
+
+
+def _is_float(value: str) -> bool:
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
 def _normalize_step(step: Dict[str, Any], index: int) -> Dict[str, Any]:
     label = str(step.get("label", f"Step {index+1}"))
     key = str(step.get("output_key", f"step{index+1}"))
@@ -255,10 +411,33 @@ def _normalize_step(step: Dict[str, Any], index: int) -> Dict[str, Any]:
         "temperature": float(step.get("temperature", 0.7)),
         "max_tokens": int(step.get("max_tokens", 1200)),
         "top_p": float(step.get("top_p", 1.0)),
+        # 0 = use default_timeout() at run time, so NODE_TIMEOUT_S changes still apply
+        "timeout": max(0.0, float(step.get("timeout") or 0)),
+        # Near-duplicate prompt reuse: 0 disables; "draft" still makes the fresh call
+        "similar_threshold": min(1.0, max(0.0, float(step.get("similar_threshold") or 0.0))),
+        "similar_mode": "draft" if step.get("similar_mode") == "draft" else "reuse",
+        # Prompt input budget in tokens (0 = only the model context window applies)
+        "input_budget": max(0, int(step.get("input_budget") or 0)),
+        "compaction": step.get("compaction") if step.get("compaction") in COMPACTION_STRATEGIES else "truncate",
+        # Best-of-N sampling: candidate i cycles through the extra models/temperatures
+        "candidates": max(1, min(MAX_CANDIDATES, int(step.get("candidates") or 1))),
+        "candidate_models": _split_list(step.get("candidate_models")),
+        "candidate_temperatures": [float(t) for t in _split_list(step.get("candidate_temperatures")) if _is_float(t)],
+        "scorer": step.get("scorer") if step.get("scorer") in SCORERS else "keywords",
+        "keywords": str(step.get("keywords", "")),
+        "target_words": max(0, int(step.get("target_words") or 0)),
     }
     return {"label": label, "output_key": key, "template": template, **params}
 
 
+def _normalize_deadline(value: Any) -> float:
+    # Whole-flow deadline in seconds; 0 disables it
+    try:
+        return max(0.0, float(value or 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
 def _ensure_flows_file() -> None:
     FLOWS_FILE.parent.mkdir(parents=True, exist_ok=True)
     # Migrate legacy single flow if present
@@ -307,7 +486,7 @@ def load_flows() -> Dict[str, Any]:
                     for i, s in enumerate(steps_in):
                         if isinstance(s, dict):
                             steps_out.append(_normalize_step(s, i))
-                flows_out.append({"name": name, "label": label, "steps": steps_out})
+                flows_out.append({"name": name, "label": label, "steps": steps_out, "deadline": _normalize_deadline(f.get("deadline"))})
         if not flows_out:
             flows_out = [{"name": "Blog", "label": "Blog", "steps": [_normalize_step(s, i) for i, s in enumerate(DEFAULT_FLOW)]}]
         return {"active": active, "flows": flows_out}
@@ -332,7 +511,7 @@ def save_flows(payload: Dict[str, Any]) -> None:
                 for i, s in enumerate(steps):
                     if isinstance(s, dict):
                         steps_out.append(_normalize_step(s, i))
-            out_flows.append({"name": name, "label": label, "steps": steps_out})
+            out_flows.append({"name": name, "label": label, "steps": steps_out, "deadline": _normalize_deadline(f.get("deadline"))})
     FLOWS_FILE.write_text(json.dumps({"active": active, "flows": out_flows}, indent=2), encoding="utf-8")
 
 
@@ -435,3 +614,269 @@ def get_execution_sequence(flow: Dict[str, Any]) -> List[Dict[str, Any]]:
     order = topological_order(nodes, edges)
     by_id = {int(n.get("id", i + 1)): n for i, n in enumerate(nodes)}
     return [by_id[i] for i in order if i in by_id]
+
+
+# Token budgeting
+def _summarize_for_budget(text: str, max_tokens: int, timeout: float | None = None, user: str | None = None, priority: str = "flow") -> str:
+    provider = os.getenv("COMPACT_PROVIDER", "Groq")
+    model = os.getenv("COMPACT_MODEL", "llama-3.1-8b-instant")
+    prompt = (
+        f"Condense the following into at most {max_tokens} tokens. Keep headings, key facts and structure; "
+        f"output Markdown only.\n\n{text}"
+    )
+    return generate(provider, prompt, None, model, 0.2, max_tokens, 1.0, timeout=timeout, user=user, priority=priority)
+
+
+def prepare_prompt(
+    node: Dict[str, Any],
+    variables: Dict[str, Any],
+    timeout: float | None = None,
+    user: str | None = None,
+    priority: str = "flow",
+) -> Tuple[str, int]:
+    # Render the node's prompt within its input budget and fit max_tokens to the
+    # remaining context window. Returns (prompt_text, max_tokens). Summaries made
+    # for compaction share the node's time budget and scheduler identity.
+    provider = str(node.get("provider", "Groq"))
+    model = str(node.get("model", get_default_model(provider)))
+    max_tokens = int(node.get("max_tokens", 1200))
+    template = str(node.get("template", ""))
+    window = context_window(model)
+    budget = int(node.get("input_budget") or 0)
+    # Leave room for at least a short answer even without an explicit budget
+    limit = min(budget, window - 256) if budget else window - min(max_tokens, window // 2)
+    template_tokens = estimate_tokens(format_prompt(template, {}), provider)
+    t_end = time.monotonic() + timeout if timeout else None
+
+    def summarize(text: str, target: int) -> str:
+        left = None if t_end is None else t_end - time.monotonic()
+        if left is not None and left < MIN_NODE_BUDGET_S:
+            raise TimeoutError("no time left to summarize")
+        return _summarize_for_budget(text, target, timeout=left, user=user, priority=priority)
+
+    fitted = fit_variables(
+        template_tokens,
+        {k: v for k, v in variables.items() if f"{{{k}}}" in template},
+        limit,
+        str(node.get("compaction", "truncate")),
+        provider,
+        summarize,
+    )
+    prompt_text = format_prompt(template, {**variables, **fitted})
+    left = window - estimate_tokens(prompt_text, provider)
+    return prompt_text, max(1, min(max_tokens, left))
+
+
+# Multi-candidate generation
+def generate_candidates(
+    node: Dict[str, Any],
+    prompt_text: str,
+    max_tokens: int,
+    timeout: float | None = None,
+    user: str | None = None,
+    priority: str = "flow",
+) -> Tuple[str, List[Dict[str, Any]]]:
+    # Fire the node's candidate samples concurrently and return (winner_text, candidates).
+    # A single-candidate node is a plain generate() call. `timeout` is the node's
+    # remaining budget: sampling and judging must both end within it.
+    provider = str(node.get("provider", "Groq"))
+    settings = candidate_settings(node)
+    if len(settings) == 1:
+        out = generate(provider, prompt_text, None, settings[0]["model"], settings[0]["temperature"], max_tokens, float(node.get("top_p", 1.0)), timeout=timeout, user=user, priority=priority)
+        return out, [{**settings[0], "text": out, "error": None, "winner": True}]
+    # Worker threads have no Streamlit session, so resolve the user up front
+    user = user or current_user()
+    until = time.monotonic() + timeout if timeout else None
+    # One admission for the whole group; each sample beyond the first queues for
+    # its own slot, so the group still respects the per-user and provider caps
+    adm = get_scheduler().admit(user=user, provider=provider, priority=priority, max_wait=timeout, slots=len(settings))
+    # Each sample gets the node's own timeout from when it gets a slot
+    per_sample = float(node.get("timeout") or default_timeout())
+
+    def sample(i: int, cfg: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            text = generate(
+                provider,
+                prompt_text,
+                None,
+                cfg["model"],
+                cfg["temperature"],
+                max_tokens,
+                float(node.get("top_p", 1.0)),
+                timeout=per_sample,
+                user=user,
+                priority=priority,
+                admission=adm,
+                sample=i,
+                until=until,
+            )
+            return {**cfg, "text": text, "error": None}
+        except Exception as e:  # noqa: BLE001
+            return {**cfg, "text": "", "error": str(e)}
+
+    judge: Admission | None = None
+    try:
+        with ThreadPoolExecutor(max_workers=len(settings)) as pool:
+            cands = list(pool.map(sample, range(len(settings)), settings))
+        ctx = {"user": user, "priority": priority, "until": until, "admission": adm, "max_tokens": max_tokens, "prompt": prompt_text}
+        judge_on = judge_provider().lower()
+        if scorer_for(node) == "judge" and judge_on != provider.lower():
+            # Hand back the sampling slot first, or the judge would queue behind it
+            # under a per-user cap of 1; then judge the group under one admission
+            adm.close()
+            left = None if until is None else max(0.001, until - time.monotonic())
+            n_ok = sum(1 for c in cands if c.get("error") is None)
+            try:
+                judge = get_scheduler().admit(user=user, provider=judge_on, priority=priority, max_wait=left, slots=max(1, n_ok))
+            except TimeoutError:
+                judge = None
+            ctx["admission"] = judge
+        best = pick_best(cands, node, ctx)
+    finally:
+        adm.close()
+        if judge is not None:
+            judge.close()
+    for i, c in enumerate(cands):
+        c["winner"] = i == best
+    if best < 0:
+        raise RuntimeError("all candidates failed: " + "; ".join(str(c["error"]) for c in cands))
+    return str(cands[best]["text"]), cands
+
+
+# Deadline budgeting
+def critical_path_weights(nodes: List[Dict[str, Any]], edges: List[Dict[str, Any]]) -> Dict[int, float]:
+    # Longest remaining path (sum of node timeouts) from each node to a sink, inclusive
+    order = topological_order(nodes, edges)
+    weight = {int(n.get("id")): float(n.get("timeout") or default_timeout()) for n in nodes if "id" in n}
+    adj: Dict[int, List[int]] = {i: [] for i in weight}
+    for e in edges:
+        try:
+            u = int(e.get("source"))
+            v = int(e.get("target"))
+        except Exception:
+            continue
+        if u in adj and v in weight:
+            adj[u].append(v)
+    out: Dict[int, float] = {}
+    for u in reversed(order):
+        out[u] = weight.get(u, 0.0) + max((out.get(v, 0.0) for v in adj.get(u, [])), default=0.0)
+    return out
+
+
+def node_time_budget(node: Dict[str, Any], remaining_s: float | None, path_weight: float) -> float:
+    # Per-node timeout, capped by this node's share of the remaining flow deadline
+    own = float(node.get("timeout") or default_timeout())
+    if remaining_s is None:
+        return own
+    if path_weight <= 0:
+        return min(own, remaining_s)
+    return min(own, remaining_s * own / path_weight)
+
+
+def run_nodes(
+    nodes: List[Dict[str, Any]],
+    edges: List[Dict[str, Any]] | None = None,
+    deadline_s: float | None = None,
+    variables: Dict[str, Any] | None = None,
+    priority: str = "flow",
+    user: str | None = None,
+    on_draft: Callable[[str, str, float], None] | None = None,
+    on_node: Callable[[str, str, str], None] | None = None,
+    cancel: threading.Event | None = None,
+) -> Dict[str, Any]:
+    # Execute nodes in dependency order within an optional whole-flow deadline.
+    # Outputs produced before the deadline (or a cancel) are kept. Nodes never
+    # started are "skipped": once the deadline share drops below MIN_NODE_BUDGET_S,
+    # and for every node downstream of a failed or skipped one.
+    # on_node(key, status, text) reports each finished or skipped node.
+    if edges is None:
+        edges = [{"source": i, "target": i + 1} for i in range(1, len(nodes))]
+    by_id = {int(n.get("id", i + 1)): n for i, n in enumerate(nodes)}
+    order = [i for i in topological_order(list(by_id.values()), edges) if i in by_id]
+    paths = critical_path_weights(list(by_id.values()), edges)
+    parents: Dict[int, List[int]] = {i: [] for i in by_id}
+    for e in edges:
+        try:
+            u = int(e.get("source"))
+            v = int(e.get("target"))
+        except Exception:
+            continue
+        if u in by_id and v in parents:
+            parents[v].append(u)
+    outputs: Dict[str, str] = {}
+    errors: Dict[str, str] = {}
+    skipped: List[str] = []
+    reused: Dict[str, float] = {}
+    candidates: Dict[str, List[Dict[str, Any]]] = {}
+    failed: set = set()
+    env = dict(variables or {})
+    t_end = time.monotonic() + deadline_s if deadline_s else None
+    # Resolve on the calling thread; worker threads have no Streamlit session
+    user = user or current_user()
+
+    def skip(nid: int) -> None:
+        k = by_id[nid].get("output_key", f"step{nid}")
+        skipped.append(k)
+        failed.add(nid)
+        if on_node is not None:
+            on_node(k, "skipped", "")
+
+    for pos, nid in enumerate(order):
+        nd = by_id[nid]
+        key = nd.get("output_key", f"step{nid}")
+        remaining = None if t_end is None else t_end - time.monotonic()
+        if (remaining is not None and remaining <= 0) or (cancel is not None and cancel.is_set()):
+            for j in order[pos:]:
+                skip(j)
+            break
+        if any(u in failed for u in parents[nid]):
+            # An upstream output is missing; don't pay for a prompt without it
+            skip(nid)
+            continue
+        budget = node_time_budget(nd, remaining, paths.get(nid, 0.0))
+        if remaining is not None and budget < min(MIN_NODE_BUDGET_S, float(nd.get("timeout") or default_timeout())):
+            for j in order[pos:]:
+                skip(j)
+            break
+        node_end = time.monotonic() + budget
+        # Reuse is checked on the uncompacted prompt, before paying for compaction
+        raw_prompt = format_prompt(nd.get("template", ""), env)
+        threshold = float(nd.get("similar_threshold") or 0.0) if reuse_enabled() else 0.0
+        if threshold > 0:
+            hit = get_index().lookup(scope_for(nd), raw_prompt, threshold)
+            if hit is not None and nd.get("similar_mode") != "draft":
+                outputs[key] = env[key] = hit[0]
+                reused[key] = hit[1]
+                if on_node is not None:
+                    on_node(key, "reused", hit[0])
+                continue
+            if hit is not None and on_draft is not None:
+                on_draft(key, hit[0], hit[1])
+        try:
+            prompt_text, max_tokens = prepare_prompt(nd, env, timeout=budget, user=user, priority=priority)
+            left = node_end - time.monotonic()
+            if left <= 0:
+                raise TimeoutError("node budget spent on prompt compaction")
+            out, cands = generate_candidates(nd, prompt_text, max_tokens, timeout=left, user=user, priority=priority)
+            if len(cands) > 1:
+                candidates[key] = cands
+        except Exception as e:  # noqa: BLE001
+            errors[key] = str(e)
+            failed.add(nid)
+            if on_node is not None:
+                on_node(key, "error", str(e))
+            continue
+        outputs[key] = out
+        env[key] = out
+        if threshold > 0:
+            get_index().add(scope_for(nd), raw_prompt, out)
+        if on_node is not None:
+            on_node(key, "done", out)
+    return {
+        "outputs": outputs,
+        "errors": errors,
+        "skipped": skipped,
+        "reused": reused,
+        "candidates": candidates,
+        "cancelled": cancel is not None and cancel.is_set(),
+    }